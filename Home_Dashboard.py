@@ -1,74 +1,72 @@
 # 🏠_Home_Dashboard.py
 
 import streamlit as st
-import time
-from hardware_controller import MockController, RaspberryPiController
-import platform
-import os
+import concurrent.futures
+import io
+from PIL import Image
+from hardware_controller import IS_PI, MockController, get_controller
 
 # --- Page Setup ---
 st.set_page_config(page_title="Smart Home Dashboard", page_icon="🏠", layout="wide", initial_sidebar_state="expanded")
 
 
 # --- Hardware Initialization ---
-# This is the core logic: Check if we are running on a Raspberry Pi.
-# If so, use the RaspberryPiController; otherwise, use the MockController.
-def get_controller():
-    # A simple way to check if we're on a Pi is to check the platform.
-    is_pi = platform.machine().startswith("arm") or platform.machine().startswith("aarch64")
+# This is the core logic: hardware_controller checks whether we are running on a
+# Raspberry Pi and builds a RaspberryPiController there, a MockController otherwise.
+# The controller is a process-wide singleton kept in hardware_controller (which is
+# imported once), so every browser session shares the same hardware and clearing
+# Streamlit's caches can't create a second instance.
+# For testing: you can force the MockController by setting IS_PI = False in
+# hardware_controller.py and restarting the server.
+hw = get_controller()
 
-    # For testing: you can force a controller like this:
-    # return MockController()
+if IS_PI and isinstance(hw, MockController):
+    st.warning("Could not initialize Raspberry Pi hardware. Falling back to Mock Controller.")
 
-    if is_pi:
-        try:
-            # This import will only succeed on a Pi with the RPi.GPIO library installed.
-            return RaspberryPiController()
-        except (ImportError, RuntimeError):
-            st.warning("Could not initialize Raspberry Pi hardware. Falling back to Mock Controller.")
-            return MockController()
-    else:
-        return MockController()
 
-
-# Initialize the controller and store it in the session state to prevent
-# re-initialization on every interaction.
-if "hw_controller" not in st.session_state:
-    st.session_state.hw_controller = get_controller()
-    st.session_state.hw_controller.setup()
-
-# Create a short alias for the controller
-hw = st.session_state.hw_controller
+# --- Helper Functions ---
+CAPTURE_TIMEOUT = 2.0  # Longest a run waits for a pending snapshot (in seconds)
 
 
-# --- Helper Functions ---
 def hex_to_rgb(hex_color):
     """Converts a hex color string to an (R, G, B) tuple."""
-    hex_color = hex_color.lstrip("#")
-    return tuple(int(hex_color[i : i + 2], 16) for i in (0, 2, 4))
+    return tuple(bytes.fromhex(hex_color.lstrip("#")))
 
 
-# --- UI Layout ---
+def encode_jpeg(frame):
+    """Encodes an RGB frame (NumPy array) to JPEG bytes."""
+    buffer = io.BytesIO()
+    Image.fromarray(frame).save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
 
-# Header
-st.title("🏠 Smart Home Dashboard")
-st.markdown("Control and monitor your connected home devices.")
 
-# --- Device Control ---
-col1, col2 = st.columns(2)
+@st.cache_data(ttl=0.9, show_spinner=False)
+def read_distance(_hw):
+    """Reads the ultrasonic sensor, reusing the last measurement for up to 0.9 seconds."""
+    # The TTL is a bit shorter than the 1s panel refresh so every refresh gets a fresh reading.
+    # The leading underscore tells Streamlit not to hash the controller object.
+    return _hw.get_distance()
 
-# --- Column 1: Lighting Controls ---
-with col1:
-    st.header("💡 Lighting")
 
+# --- Device Panels ---
+# Each panel is a fragment, so interacting with one widget only reruns its own panel
+# instead of the whole dashboard (and every hardware call in it). Sensor panels also
+# refresh themselves at 1Hz so readings stay live without user interaction.
+@st.fragment
+def bedroom_light_panel(hw):
+    """Bedroom light panel: PWM brightness control."""
     with st.container(border=True):
         st.subheader("Bedroom Light")
         brightness = st.slider("Brightness", min_value=0, max_value=100, value=100, step=1, key="dimmable_light_slider")
+        # The controller skips the write itself when the LED already has this value
         hw.set_dimmable_light(brightness)
         if isinstance(hw, MockController):
             st.info("This demonstrates controlling LED brightness using PWM (Pulse Width Modulation).")
 
-    # Mood Lamp (Represented by an RGB LED)
+
+@st.fragment
+def mood_lamp_panel(hw):
+    """Mood lamp panel: RGB LED color control."""
     with st.container(border=True):
         st.subheader("RGB Mood Lamp")
         color = st.color_picker("Choose a color", "#FFFFFF", key="mood_lamp_picker")
@@ -78,29 +76,32 @@ with col1:
             st.info("This controls each channel (Red, Green, Blue) of an RGB LED with three PWM signals.")
 
 
-# --- Column 2: Sensors & Security ---
-with col2:
-    st.header("🔬 Sensors & Security")
-
-    # Doorbell (Represented by a Push Button)
+@st.fragment(run_every=1.0)
+def doorbell_panel(hw):
+    """Doorbell panel: push button status, refreshed once per second."""
     with st.container(border=True):
         st.subheader("Doorbell")
         if isinstance(hw, MockController):
             st.info("In Mock Mode, you can press the button below to simulate the doorbell.")
             if st.button("Simulate Doorbell Press"):
-                # Directly toggle the internal state of the MockController
+                # Directly toggle the internal state of the MockController.
+                # The click already reruns this fragment, and the status below is read afterwards.
                 hw._doorbell_pressed = not hw._doorbell_pressed
-                st.rerun()  # Refresh the screen to update status
 
+        # Render the status into a single placeholder that is updated in place
+        status = st.empty()
         if hw.read_doorbell():
-            st.success("🔔 **Ding-dong!** Someone is at the door!")
+            status.success("🔔 **Ding-dong!** Someone is at the door!")
         else:
-            st.write("No one at the door.")
+            status.write("No one at the door.")
 
-    # Presence Sensor (Represented by an Ultrasonic Sensor)
+
+@st.fragment(run_every=1.0)
+def proximity_panel(hw):
+    """Proximity panel: ultrasonic distance reading, refreshed once per second."""
     with st.container(border=True):
         st.subheader("Garage Proximity Sensor")
-        distance = hw.get_distance()
+        distance = read_distance(hw)
 
         # Define a threshold for object detection
         detection_threshold = 20.0  # in cm
@@ -116,24 +117,76 @@ with col2:
         if isinstance(hw, MockController):
             st.info("This uses an ultrasonic sensor to measure distance.")
 
-    # Security Camera (Represented by a Pi Camera)
+
+@st.fragment
+def camera_panel(hw):
+    """Security camera panel. Capture runs on the controller's worker thread; the panel waits on it briefly."""
     with st.container(border=True):
         st.subheader("Security Camera")
 
-        if st.button("Take Snapshot 📸"):
-            with st.spinner("Capturing image..."):
-                # Define the image path
-                image_path = "snapshot.jpg"
-
-                # Use the controller to capture the image
-                captured_path = hw.capture_image(image_path)
+        if st.button("Take Snapshot 📸") and "capture_future" not in st.session_state:
+            # Start the capture in the background
+            st.session_state.capture_future = hw.capture_snapshot_async()
 
-                if captured_path and os.path.exists(captured_path):
-                    st.image(captured_path, caption="Live Snapshot", use_column_width=True)
-                else:
-                    st.error("Failed to capture image.")
+        future = st.session_state.get("capture_future")
+        if future is not None and not future.done():
+            # A capture from the running stream takes about one frame, so a short bounded wait
+            # here is enough; anything slower is picked up on the next interaction.
+            with st.spinner("Capturing image..."):
+                try:
+                    future.result(timeout=CAPTURE_TIMEOUT)
+                except concurrent.futures.TimeoutError:
+                    pass
+            if not future.done():
+                st.warning("The camera is still busy. Press the button again to show the snapshot.")
+                future = None
+
+        if future is not None:
+            del st.session_state.capture_future
+            frame = future.result()
+            if frame is not None:
+                # Keep the encoded JPEG in memory so later reruns can redraw it without
+                # re-capturing or re-encoding the raw frame
+                st.session_state.last_snapshot = encode_jpeg(frame)
+            else:
+                st.error("Failed to capture image.")
+
+        if "last_snapshot" in st.session_state:
+            st.image(st.session_state.last_snapshot, caption="Live Snapshot", use_column_width=True)
         if isinstance(hw, MockController):
             st.info("This uses the Pi Camera module to capture a live image.")
 
+
+# --- UI Layout ---
+
+# Header
+st.title("🏠 Smart Home Dashboard")
+st.markdown("Control and monitor your connected home devices.")
+
+# --- Device Control ---
+col1, col2 = st.columns(2)
+
+# --- Column 1: Lighting Controls ---
+with col1:
+    st.header("💡 Lighting")
+    bedroom_light_panel(hw)
+
+    # Mood Lamp (Represented by an RGB LED)
+    mood_lamp_panel(hw)
+
+
+# --- Column 2: Sensors & Security ---
+with col2:
+    st.header("🔬 Sensors & Security")
+
+    # Doorbell (Represented by a Push Button)
+    doorbell_panel(hw)
+
+    # Presence Sensor (Represented by an Ultrasonic Sensor)
+    proximity_panel(hw)
+
+    # Security Camera (Represented by a Pi Camera)
+    camera_panel(hw)
+
 # --- Footer / Cleanup ---
 st.sidebar.info("Attempting to clean up GPIO resources on app exit.")
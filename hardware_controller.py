@@ -1,8 +1,27 @@
 # hardware_controller.py
 
+import atexit
 import time
-import numpy as np
 import os
+import platform
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 하드웨어 동작 로그. 매 호출마다 출력되는 메시지는 DEBUG 레벨이므로 기본(INFO)에서는 비용이 거의 없습니다.
+# HW_LOG_LEVEL 환경 변수로 레벨을 바꿀 수 있습니다 (예: HW_LOG_LEVEL=DEBUG).
+log = logging.getLogger(__name__)
+_level = logging.getLevelName(os.environ.get("HW_LOG_LEVEL", "INFO").upper())
+log.setLevel(_level if isinstance(_level, int) else logging.INFO)  # 알 수 없는 값이면 INFO로 대체
+if not log.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+
+# A simple way to check if we're on a Pi is to check the platform.
+# Evaluated once, when this module is first imported.
+IS_PI = platform.machine().startswith(("arm", "aarch64"))
 
 
 class BaseController:
@@ -32,6 +51,12 @@ class BaseController:
     def capture_image(self, output_path):
         raise NotImplementedError
 
+    def capture_snapshot(self):
+        raise NotImplementedError
+
+    def capture_snapshot_async(self):
+        raise NotImplementedError
+
     def cleanup(self):
         raise NotImplementedError
 
@@ -48,24 +73,25 @@ class MockController(BaseController):
         self._dimmable_light_brightness = 100
         self._mood_lamp_color = (255, 255, 255)
         self._doorbell_pressed = False
-        print("✅ Mock hardware controller initialized.")
+        self._pool = ThreadPoolExecutor(max_workers=1)
+        log.info("✅ Mock hardware controller initialized.")
 
     def setup(self):
-        print("🔧 Mock setup: No action needed as hardware is simulated.")
+        log.info("🔧 Mock setup: No action needed as hardware is simulated.")
         pass
 
     def set_room_light(self, state):
         self._room_light_state = state
         status = "ON" if state else "OFF"
-        print(f"💡 Mock Room Light -> {status}")
+        log.debug("💡 Mock Room Light -> %s", status)
 
     def set_dimmable_light(self, brightness):
         self._dimmable_light_brightness = brightness
-        print(f"💡 Mock Dimmable Light -> Brightness {brightness}%")
+        log.debug("💡 Mock Dimmable Light -> Brightness %s%%", brightness)
 
     def set_mood_lamp_color(self, r, g, b):
         self._mood_lamp_color = (r, g, b)
-        print(f"🎨 Mock Mood Lamp -> Color ({r}, {g}, {b})")
+        log.debug("🎨 Mock Mood Lamp -> Color (%s, %s, %s)", r, g, b)
 
     def read_doorbell(self):
         # In a real scenario, this would read a pin. We simulate it here.
@@ -75,7 +101,7 @@ class MockController(BaseController):
     def get_distance(self):
         # Simulate the distance sensor with some noise
         base_distance = 80
-        noise = np.random.uniform(-1.5, 1.5)
+        noise = random.uniform(-1.5, 1.5)
         return round(base_distance + noise, 1)
 
     def capture_image(self, output_path):
@@ -83,21 +109,37 @@ class MockController(BaseController):
         placeholder_path = os.path.join("assets", "placeholder.jpg")
         if os.path.exists(placeholder_path):
             # In a real app, this should copy the file to output_path
-            print(f"📸 Mock Camera -> Using placeholder at {placeholder_path}")
+            log.debug("📸 Mock Camera -> Using placeholder at %s", placeholder_path)
             return placeholder_path
         else:
-            print("Error: Placeholder image not found at assets/placeholder.jpg.")
+            log.error("Error: Placeholder image not found at assets/placeholder.jpg.")
             return None
 
+    def capture_snapshot(self):
+        # Simulate a camera frame with a simple RGB gradient.
+        import numpy as np  # Imported lazily; only needed once a snapshot is requested.
+
+        gradient = np.linspace(0, 255, 640, dtype=np.uint8)
+        frame = np.empty((480, 640, 3), dtype=np.uint8)
+        frame[..., 0] = gradient
+        frame[..., 1] = gradient[::-1]
+        frame[..., 2] = 128
+        log.debug("📸 Mock Camera -> Generated placeholder frame")
+        return frame
+
+    def capture_snapshot_async(self):
+        return self._pool.submit(self.capture_snapshot)
+
     def cleanup(self):
-        print("🧹 Mock cleanup: No action needed.")
-        pass
+        self._pool.shutdown(wait=True)
+        log.info("🧹 Mock cleanup: Worker thread stopped.")
 
 
 class RaspberryPiController(BaseController):
     """
     라즈베리파이를 위한 실제 하드웨어 컨트롤러입니다.
-    RPi.GPIO와 picamera2를 사용하여 실제 하드웨어를 제어합니다.
+    RPi.GPIO, pigpio, picamera2를 사용하여 실제 하드웨어를 제어합니다.
+    PWM 출력은 CPU를 쓰지 않도록 pigpio 데몬(pigpiod)의 하드웨어/DMA PWM으로 생성합니다.
 
     참고: 이 코드는 제공된 마크다운 문서를 기반으로 하며,
     다음과 같은 핀 연결을 가정합니다:
@@ -108,19 +150,30 @@ class RaspberryPiController(BaseController):
     - 초음파 센서: Trig=GPIO 22, Echo=GPIO 27
     """
 
+    MAX_DISTANCE = 400.0  # 에코가 제때 돌아오지 않을 때 반환하는 "측정 범위 밖" 값 (cm)
+
     def __init__(self):
         # --- 라즈베리파이 전용 라이브러리 임포트 ---
         # 이 컨트롤러는 라즈베리파이에서만 인스턴스화되어야 합니다.
         try:
             import RPi.GPIO as GPIO
+            import pigpio
             from picamera2 import Picamera2
         except (ImportError, RuntimeError) as e:
-            print(f"Error: Could not import Raspberry Pi libraries. {e}")
-            print("Please ensure this program is running on a Raspberry Pi and not in Mock mode.")
+            log.error("Error: Could not import Raspberry Pi libraries. %s", e)
+            log.error("Please ensure this program is running on a Raspberry Pi and not in Mock mode.")
             raise
 
         self.GPIO = GPIO
+        self.pigpio = pigpio
         self.Picamera2 = Picamera2
+
+        # pigpio는 pigpiod 데몬에 연결하여 PWM 신호를 생성합니다.
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            log.error("Error: Could not connect to the pigpio daemon.")
+            log.error("Please start it with 'sudo pigpiod' before running the dashboard.")
+            raise RuntimeError("pigpio daemon is not running")
         # -----------------------------------------
 
         # 제공된 문서 기반 GPIO 핀 매핑 (BCM 모드 기준)
@@ -133,77 +186,95 @@ class RaspberryPiController(BaseController):
         self.G_PIN = 23  # RGB Green (물리적 핀 16)
         self.B_PIN = 24  # RGB Blue (물리적 핀 18)
 
-        self.pwm_led = None
-        self.pwm_r = None
-        self.pwm_g = None
-        self.pwm_b = None
+        self.LED_PWM_FREQ = 500  # 거실 조명 하드웨어 PWM 주파수 (Hz)
+        self.RGB_PWM_FREQ = 100  # RGB 무드 램프 PWM 주파수 (Hz)
+
+        # 마지막으로 출력한 듀티 값 (같은 값이면 PWM을 다시 설정하지 않음)
+        self._last_led_duty = None
+        self._last_rgb = None
 
         self.picam2 = None
-        print("✅ Raspberry Pi hardware controller initialized.")
+        # 카메라 촬영은 Streamlit 스레드를 막지 않도록 별도 워커 스레드에서 실행합니다.
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+        # 초음파 센서의 마지막 트리거 시각 (측정 간 최소 간격 보장용)
+        self._last_trig_ts = 0.0
+        log.info("✅ Raspberry Pi hardware controller initialized.")
 
     def setup(self):
-        print("🔧 Raspberry Pi Setup: Configuring GPIO pins...")
+        log.info("🔧 Raspberry Pi Setup: Configuring GPIO pins...")
         self.GPIO.setmode(self.GPIO.BCM)
         self.GPIO.setwarnings(False)
 
-        # 거실 조명 & 밝기 조절 조명 (핀 공유)
-        self.GPIO.setup(self.LED_PIN, self.GPIO.OUT)
-        self.pwm_led = self.GPIO.PWM(self.LED_PIN, 500)  # 500 Hz 주파수
-        self.pwm_led.start(0)  # 꺼진 상태에서 시작
-
-        # RGB 무드 램프
-        self.GPIO.setup([self.R_PIN, self.G_PIN, self.B_PIN], self.GPIO.OUT)
-        self.pwm_r = self.GPIO.PWM(self.R_PIN, 100)
-        self.pwm_g = self.GPIO.PWM(self.G_PIN, 100)
-        self.pwm_b = self.GPIO.PWM(self.B_PIN, 100)
-        self.pwm_r.start(0)
-        self.pwm_g.start(0)
-        self.pwm_b.start(0)
-
-        # 초인종 버튼
-        self.GPIO.setup(self.BTN_PIN, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
-
-        # 초음파 센서
+        # 핀 방향 설정 (PWM 핀은 pigpio가 직접 관리합니다)
+        # 출력: 초음파 Trig
         self.GPIO.setup(self.TRIG_PIN, self.GPIO.OUT)
+        # 입력: 초인종 버튼 (풀업), 초음파 Echo
+        self.GPIO.setup(self.BTN_PIN, self.GPIO.IN, pull_up_down=self.GPIO.PUD_UP)
         self.GPIO.setup(self.ECHO_PIN, self.GPIO.IN)
 
+        # 거실 조명 & 밝기 조절 조명 (핀 공유): GPIO 12의 하드웨어 PWM 사용
+        self.pi.hardware_PWM(self.LED_PIN, self.LED_PWM_FREQ, 0)  # 꺼진 상태에서 시작
+
+        # RGB 무드 램프
+        # GPIO 18은 GPIO 12와 같은 PWM 채널을, GPIO 23/24는 하드웨어 PWM이 없으므로
+        # pigpio의 DMA 타이밍 PWM을 사용합니다. 범위를 255로 두어 색상 값을 그대로 듀티로 씁니다.
+        for pin in (self.R_PIN, self.G_PIN, self.B_PIN):
+            self.pi.set_PWM_frequency(pin, self.RGB_PWM_FREQ)
+            self.pi.set_PWM_range(pin, 255)
+            self.pi.set_PWM_dutycycle(pin, 0)
+        self._last_led_duty = 0
+        self._last_rgb = (0, 0, 0)
+
         # 파이 카메라
         try:
-            print("📷 Attempting to initialize camera...")
+            log.info("📷 Attempting to initialize camera...")
             self.picam2 = self.Picamera2()
-            config = self.picam2.create_still_configuration()
+            # 촬영마다 센서 모드를 전환하지 않도록 720p 비디오 설정으로 한 번만 구성해 둡니다.
+            # picamera2의 "BGR888" 포맷은 배열을 [R, G, B] 순서로 돌려주므로 st.image에 바로 넘길 수 있습니다.
+            config = self.picam2.create_video_configuration(main={"size": (1280, 720), "format": "BGR888"})
             self.picam2.configure(config)
             self.picam2.start()
             time.sleep(1)  # Allow camera to warm up
             if self.picam2.started:
-                print("✅ Camera started successfully.")
+                log.info("✅ Camera started successfully.")
             else:
-                print("⚠️ Camera failed to start, but no exception was raised. The button might not be displayed in the UI.")
+                log.warning("⚠️ Camera failed to start, but no exception was raised. The button might not be displayed in the UI.")
                 self.picam2 = None  # Explicitly set to None for UI checks
         except Exception as e:
-            print(f"❌ Critical error during camera setup: {e}")
-            print("    Please ensure the camera is connected and enabled correctly.")
+            log.error("❌ Critical error during camera setup: %s", e)
+            log.error("    Please ensure the camera is connected and enabled correctly.")
             self.picam2 = None  # Explicitly set to None for UI checks
 
-        print("✅ GPIO setup complete.")
+        log.info("✅ GPIO setup complete.")
 
     def set_room_light(self, state):
         # Set duty cycle to 100% or 0% for simple on/off
         brightness = 100 if state else 0
-        self.pwm_led.ChangeDutyCycle(brightness)
+        if brightness == self._last_led_duty:
+            return
+        self.pi.hardware_PWM(self.LED_PIN, self.LED_PWM_FREQ, brightness * 10000)
+        self._last_led_duty = brightness
         status = "ON" if state else "OFF"
-        print(f"💡 Room Light -> {status}")
+        log.debug("💡 Room Light -> %s", status)
 
     def set_dimmable_light(self, brightness):
-        self.pwm_led.ChangeDutyCycle(brightness)
-        print(f"💡 Dimmable Light -> Brightness {brightness}%")
+        if brightness == self._last_led_duty:
+            return
+        # hardware_PWM duty cycle ranges from 0 to 1,000,000 (= 100%)
+        self.pi.hardware_PWM(self.LED_PIN, self.LED_PWM_FREQ, int(brightness * 10000))
+        self._last_led_duty = brightness
+        log.debug("💡 Dimmable Light -> Brightness %s%%", brightness)
 
     def set_mood_lamp_color(self, r, g, b):
-        # Convert 0-255 color values to 0-100 duty cycle
-        self.pwm_r.ChangeDutyCycle(r / 255.0 * 100)
-        self.pwm_g.ChangeDutyCycle(g / 255.0 * 100)
-        self.pwm_b.ChangeDutyCycle(b / 255.0 * 100)
-        print(f"🎨 Mood Lamp -> Color ({r}, {g}, {b})")
+        if (r, g, b) == self._last_rgb:
+            return
+        # PWM range is 0-255, so color values map directly to duty cycle
+        self.pi.set_PWM_dutycycle(self.R_PIN, r)
+        self.pi.set_PWM_dutycycle(self.G_PIN, g)
+        self.pi.set_PWM_dutycycle(self.B_PIN, b)
+        self._last_rgb = (r, g, b)
+        log.debug("🎨 Mood Lamp -> Color (%s, %s, %s)", r, g, b)
 
     def read_doorbell(self):
         # Button press pulls the GPIO pin to LOW due to PUD_UP
@@ -211,37 +282,105 @@ class RaspberryPiController(BaseController):
 
     def get_distance(self):
         self.GPIO.output(self.TRIG_PIN, False)
-        time.sleep(0.5)
-
-        self.GPIO.output(self.TRIG_PIN, True)
-        time.sleep(0.00001)
-        self.GPIO.output(self.TRIG_PIN, False)
-
-        while self.GPIO.input(self.ECHO_PIN) == 0:
-            pulse_start = time.time()
-
-        while self.GPIO.input(self.ECHO_PIN) == 1:
-            pulse_end = time.time()
-
-        pulse_duration = pulse_end - pulse_start
+        # HC-SR04 needs ~60ms between measurements; only wait out what's left of it.
+        elapsed = time.monotonic() - self._last_trig_ts
+        if elapsed < 0.06:
+            time.sleep(0.06 - elapsed)
+
+        # Start watching the echo pin before triggering, and take the pulse width from pigpio's
+        # µs edge ticks (recorded by the daemon) so neither a short pulse nor scheduler jitter
+        # in this thread can skew it.
+        edges = {}
+        echo_done = threading.Event()
+
+        def on_echo_edge(gpio, level, tick):
+            if level == 1:
+                edges["rise"] = tick
+            elif level == 0 and "rise" in edges:
+                edges["fall"] = tick
+                echo_done.set()
+
+        cb = self.pi.callback(self.ECHO_PIN, self.pigpio.EITHER_EDGE, on_echo_edge)
+        try:
+            self.GPIO.output(self.TRIG_PIN, True)
+            time.sleep(0.00001)
+            self.GPIO.output(self.TRIG_PIN, False)
+            self._last_trig_ts = time.monotonic()
+
+            # Bounded wait so a missed echo can't hang the app (~38ms ≈ 6.5m range).
+            if not echo_done.wait(0.04):
+                return self.MAX_DISTANCE
+        finally:
+            cb.cancel()
+
+        pulse_duration = self.pigpio.tickDiff(edges["rise"], edges["fall"]) * 1e-6
         distance = pulse_duration * 17150  # Speed of sound (34300 cm/s) / 2
         return round(distance, 2)
 
     def capture_image(self, output_path):
         try:
-            self.picam2.capture_file(output_path)
-            print(f"📸 Camera -> Image saved to {output_path}")
+            self.picam2.capture_file(output_path, format="jpeg")
+            log.debug("📸 Camera -> Image saved to %s", output_path)
             return output_path
         except Exception as e:
-            print(f"❌ Camera Error: Failed to capture image. Error: {e}")
+            log.error("❌ Camera Error: Failed to capture image. Error: %s", e)
+            return None
+
+    def capture_snapshot(self):
+        # Grab the frame straight from the running camera instead of round-tripping through a JPEG on disk.
+        try:
+            frame = self.picam2.capture_array("main")
+            log.debug("📸 Camera -> Captured frame into memory")
+            return frame
+        except Exception as e:
+            log.error("❌ Camera Error: Failed to capture frame. Error: %s", e)
             return None
 
+    def capture_snapshot_async(self):
+        # Returns a Future that resolves to the same value as capture_snapshot().
+        return self._pool.submit(self.capture_snapshot)
+
     def cleanup(self):
-        print("🧹 Cleaning up GPIO pins...")
-        self.pwm_led.stop()
-        self.pwm_r.stop()
-        self.pwm_g.stop()
-        self.pwm_b.stop()
+        log.info("🧹 Cleaning up GPIO pins...")
+        self._pool.shutdown(wait=True)
+        self.pi.hardware_PWM(self.LED_PIN, 0, 0)
+        for pin in (self.R_PIN, self.G_PIN, self.B_PIN):
+            self.pi.set_PWM_dutycycle(pin, 0)
+        self.pi.stop()
         self.GPIO.cleanup()
-        self.picam2.stop()
-        print("✅ Cleanup complete.")
+        # setup() leaves picam2 as None when the camera failed to start
+        if self.picam2 is not None:
+            self.picam2.stop()
+        log.info("✅ Cleanup complete.")
+
+
+# 프로세스 전체에서 공유하는 컨트롤러 인스턴스.
+# Streamlit 캐시가 아닌 모듈 변수에 두므로 "Clear cache"로 지워지지 않아,
+# 카메라와 pigpio 핸들을 쥔 컨트롤러가 두 개 만들어지는 일이 없습니다.
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """
+    공유 하드웨어 컨트롤러를 반환합니다. 처음 호출될 때만 생성하고 setup()을 실행합니다.
+    라즈베리파이에서는 RaspberryPiController를, 그 외에는 MockController를 사용합니다.
+    """
+    global _controller
+    # 여러 브라우저 세션의 스크립트 스레드가 동시에 호출할 수 있으므로 잠금으로 보호합니다.
+    with _controller_lock:
+        if _controller is None:
+            if IS_PI:
+                try:
+                    controller = RaspberryPiController()
+                except (ImportError, RuntimeError):
+                    log.warning("Could not initialize Raspberry Pi hardware. Falling back to Mock Controller.")
+                    controller = MockController()
+            else:
+                controller = MockController()
+
+            controller.setup()
+            # Release GPIO pins and the camera when the process exits.
+            atexit.register(controller.cleanup)
+            _controller = controller
+    return _controller